@@ -0,0 +1,36 @@
+# gunicorn settings for serving wsgi:app; override any value with GUNICORN_* env vars below.
+# Run `python server.py migrate` before starting gunicorn: workers don't create the user_id
+# sequence or the unique indexes themselves (see migrate() in server.py).
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:5000')
+
+# Each worker opens its own DB pool of DB_POOL_MAX connections (same env var server.py reads),
+# so workers * DB_POOL_MAX must stay within the connections Postgres can give this app:
+# DB_CONNECTION_BUDGET, default 90 of Postgres's default max_connections=100 (the rest is
+# left for superuser/maintenance sessions).
+db_pool_max = int(os.environ.get('DB_POOL_MAX', 10))
+db_connection_budget = int(os.environ.get('DB_CONNECTION_BUDGET', 90))
+
+# 2*cpu+1 workers, capped by the connection budget. Password hashing (scrypt) is CPU-bound and
+# blocks its worker's whole gevent loop while it runs, so CPU parallelism comes from workers,
+# not greenlets.
+workers = int(os.environ.get('GUNICORN_WORKERS',
+                             max(1, min(multiprocessing.cpu_count() * 2 + 1,
+                                        db_connection_budget // db_pool_max))))
+if workers * db_pool_max > db_connection_budget:
+    raise RuntimeError(
+        f'{workers} workers x DB_POOL_MAX={db_pool_max} connections exceeds '
+        f'DB_CONNECTION_BUDGET={db_connection_budget}; lower GUNICORN_WORKERS or DB_POOL_MAX'
+    )
+
+# gevent workers multiplex many requests per process while they wait on I/O. Requests beyond
+# the pool size queue for a connection (up to DB_POOL_TIMEOUT, then 503), so keep the number
+# of concurrent greenlets a small multiple of the pool rather than thousands.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', db_pool_max * 4))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
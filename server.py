@@ -1,283 +1,746 @@
 import os
+import sys
+import io
+import csv
+import time
+import hmac
 import logging
+import itertools
+import threading
 from flask import Flask, request, render_template, redirect, url_for, send_from_directory, session
 from jinja2 import TemplateNotFound
+from werkzeug.security import generate_password_hash, check_password_hash
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+from psycopg2.extensions import AsIs
+from psycopg2.pool import ThreadedConnectionPool
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+# INFO by default; set LOG_LEVEL=DEBUG to log received form data etc.
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s %(levelname)s %(message)s')
 log = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET', 'dev-secret')
 
+# The HTML pages live in the project root (GitHub Pages serves them from there too).
+# Serve them with a long Cache-Control and ETag/Last-Modified so repeat visits get 304s;
+# in production a front proxy can serve these directly and only pass app routes to Flask.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 86400))
+
+# Error pages go through one autoescaped Jinja template (form values are user input), loaded once here.
+ERROR_TEMPLATE = app.jinja_env.get_template('error.html')
+
+def error_page(title, status, message=None, value=None, login_link=False, back='/'):
+    return render_template(ERROR_TEMPLATE, title=title, message=message, value=value,
+                           login_link=login_link, back=back), status
+
 log.debug("Starting server.py - attempting DB connect and app setup")
 
-# Try to connect to DB with error handling so the server can start even if DB is down
+# Connection subclass that remembers which server-side prepared statements exist on it,
+# so each pooled connection PREPAREs a statement once and only EXECUTEs it afterwards.
+class RegistrationConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+# Try to create the connection pool with error handling so the server can start even if DB is down.
+# Each request checks out its own connection/cursor, so concurrent requests never share a cursor.
 db_connect_error = None
-conn = None
-cur = None
+POOL = None
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+# seconds a request waits for a free pooled connection before giving up with a 503
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
 try:
-    conn = psycopg2.connect(
+    POOL = ThreadedConnectionPool(
+        int(os.environ.get('DB_POOL_MIN', 1)),
+        DB_POOL_MAX,
         dbname='Registration',
         user='postgres',
         password='1516',
         host='localhost',
-        port='5432'
+        port='5432',
+        # TCP keepalives stop NAT/firewall idle timeouts from silently dropping pooled connections
+        keepalives=1,
+        keepalives_idle=int(os.environ.get('DB_KEEPALIVES_IDLE', 30)),
+        keepalives_interval=int(os.environ.get('DB_KEEPALIVES_INTERVAL', 10)),
+        keepalives_count=int(os.environ.get('DB_KEEPALIVES_COUNT', 5)),
+        connection_factory=RegistrationConnection
     )
-    cur = conn.cursor()
     log.info("Connected to Postgres successfully")
 except Exception as e:
     db_connect_error = str(e)
-    conn = None
-    cur = None
+    POOL = None
     log.warning("Postgres connect failed: %s", db_connect_error)
 
-# Ensure the user_id sequence exists and is linked to the registration table
-if cur is not None:
+# ThreadedConnectionPool.getconn() raises PoolError instead of waiting when every connection is
+# checked out, so gate checkouts with a semaphore sized to the pool: requests queue for a free
+# connection and only fail (PoolTimeout -> 503) after DB_POOL_TIMEOUT seconds.
+# Under gevent, threading is monkey-patched before this module loads, so waiting yields.
+_POOL_SLOTS = threading.BoundedSemaphore(DB_POOL_MAX)
+
+class PoolTimeout(Exception):
+    pass
+
+@app.errorhandler(PoolTimeout)
+def pool_timeout(e):
+    log.warning("No DB connection free after %ss", DB_POOL_TIMEOUT)
+    return error_page('Server busy', 503, message='The server is handling too many requests. Please try again shortly.')
+
+# check out a pooled connection and yield (conn, cur); the connection goes back to the pool on exit.
+# Don't nest: holding one connection while waiting for another can deadlock once the pool is full.
+@contextmanager
+def get_cursor():
+    if not _POOL_SLOTS.acquire(timeout=DB_POOL_TIMEOUT):
+        raise PoolTimeout()
     try:
-        cur.execute("""
-            CREATE SEQUENCE IF NOT EXISTS registration_user_id_seq;
-            ALTER TABLE registration ALTER COLUMN user_id SET DEFAULT nextval('registration_user_id_seq');
-            ALTER SEQUENCE registration_user_id_seq OWNED BY registration.user_id;
-            SELECT setval('registration_user_id_seq', COALESCE((SELECT MAX(user_id) FROM registration), 0) );
-        """)
-        conn.commit()
-        log.info("Ensured registration_user_id_seq sequence is set up")
-    except Exception as e:
-        log.warning("Failed to set up user_id sequence: %s", e)
-        if conn:
+        conn = POOL.getconn()
+    except Exception:
+        _POOL_SLOTS.release()
+        raise
+    broken = False
+    try:
+        with conn.cursor() as cur:
+            yield conn, cur
+    finally:
+        # only a lost server connection (conn.closed) is discarded; errors such as QueryCanceled or
+        # lock timeouts leave a healthy connection that just needs its transaction rolled back
+        if not conn.closed:
             try:
+                # no-op unless the caller left a transaction open
                 conn.rollback()
             except Exception:
-                log.exception("Rollback failed during sequence setup")
+                broken = True
+                log.exception("Rollback failed returning connection to pool")
+        # psycopg2 marks conn.closed when the server connection is lost; never hand that back out
+        POOL.putconn(conn, close=broken or bool(conn.closed))
+        _POOL_SLOTS.release()
+
+# Run a read-only query and return fetchone() (or fetchall()). If the pooled connection turns
+# out to be dead, retry once on a fresh one. Not for writes: a lost commit may still have applied.
+def read_query(sql, params=None, fetchall=False):
+    for attempt in (1, 2):
+        conn = None
+        try:
+            with get_cursor() as (conn, cur):
+                cur.execute(sql, params)
+                return cur.fetchall() if fetchall else cur.fetchone()
+        except psycopg2.OperationalError as e:
+            if attempt == 2 or conn is None or not conn.closed:
+                raise
+            log.warning("DB connection lost (%s), retrying on a fresh connection", e)
+
+# One-off schema setup: the user_id sequence and the unique indexes. ALTER TABLE takes an ACCESS
+# EXCLUSIVE lock on registration and the index builds block writes, so this does not run at import
+# (every gunicorn worker would repeat it on each boot and restart while others serve traffic).
+# Deployment step: run `python server.py migrate` once per deploy, before starting gunicorn.
+# `python server.py` (development server) runs it before serving.
+def migrate():
+    global UNIQUE_INDEXES
+    if POOL is None:
+        log.warning("Skipping migrations because DB connection is not available: %s", db_connect_error)
+        return
+    # Ensure the user_id sequence exists and is linked to the registration table
+    try:
+        with get_cursor() as (conn, cur):
+            cur.execute("""
+                SELECT column_default FROM information_schema.columns
+                WHERE table_name = 'registration' AND column_name = 'user_id'
+            """)
+            row = cur.fetchone()
+            if row is not None and 'registration_user_id_seq' not in (row[0] or ''):
+                # first-time setup only: re-running setval against live inserts could hand out
+                # an id that is already taken
+                cur.execute("""
+                    CREATE SEQUENCE IF NOT EXISTS registration_user_id_seq;
+                    ALTER TABLE registration ALTER COLUMN user_id SET DEFAULT nextval('registration_user_id_seq');
+                    ALTER SEQUENCE registration_user_id_seq OWNED BY registration.user_id;
+                    SELECT setval('registration_user_id_seq', COALESCE((SELECT MAX(user_id) FROM registration), 0) );
+                """)
+                conn.commit()
+        log.info("Ensured registration_user_id_seq sequence is set up")
+    except Exception as e:
+        log.warning("Failed to set up user_id sequence: %s", e)
+
+    # Unique indexes backing the duplicate checks (see UNIQUE_INDEXES)
+    try:
+        with get_cursor() as (conn, cur):
+            cur.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS reg_email_lower_uniq ON registration (LOWER(email));
+                CREATE UNIQUE INDEX IF NOT EXISTS reg_username_uniq ON registration (username);
+            """)
+            conn.commit()
+        UNIQUE_INDEXES = True
+        log.info("Ensured unique indexes on registration email/username")
+    except Exception as e:
+        # e.g. existing duplicate rows: clean them up so the indexes can be built
+        log.error("Failed to create registration unique indexes, falling back to pre-insert"
+                  " duplicate checks (not race-free): %s", e)
+
+    # pick up the user_id default in this process's insert plan
+    try:
+        load_schema()
+    except Exception as e:
+        log.warning("Failed to load registration schema: %s", e)
+
+# Unique indexes backing the duplicate checks: LOWER(email) so the case-insensitive lookup is an
+# index probe instead of a table scan, and username. They also let the INSERT use ON CONFLICT.
+# Without them ON CONFLICT has nothing to conflict on, so /submit falls back to an explicit
+# pre-insert duplicate check while UNIQUE_INDEXES is False. At startup this is only a catalog
+# read; migrate() creates the indexes.
+UNIQUE_INDEXES = False
+if POOL is not None:
+    try:
+        rows = read_query("""
+            SELECT indexname FROM pg_indexes
+            WHERE tablename = 'registration' AND indexname IN ('reg_email_lower_uniq', 'reg_username_uniq')
+        """, fetchall=True)
+        UNIQUE_INDEXES = len(rows) == 2
+    except Exception as e:
+        log.warning("Failed to check registration unique indexes: %s", e)
+    if not UNIQUE_INDEXES:
+        log.error("registration unique indexes missing (run `python server.py migrate`), falling back"
+                  " to pre-insert duplicate checks (not race-free)")
+
+# registration columns the form can fill, in insert order
+DESIRED_ORDER = ['full_name','user_id','username','password_hash','email','phone','father_name','mother_name','address','age']
+
+# Column types and nullability/default metadata for the registration table, plus the insert
+# plan derived from them. Loaded once at startup; call load_schema() again (or hit
+# /admin/reload_schema) after DDL changes. A reload builds a new InsertPlan and swaps it in with a
+# single assignment, so a request that grabs PLAN once sees one consistent snapshot throughout.
+class InsertPlan:
+    def __init__(self, rows=(), generation=0):
+        # part of every prepared statement name: Postgres fixes parameter types at PREPARE time,
+        # so statements prepared against an older schema must never be reused after a reload
+        self.generation = generation
+        self.schema = {r[0]: r[1] for r in rows}
+        self.colmeta = {r[0]: {'is_nullable': r[2], 'default': r[3]} for r in rows}
+        # DESIRED_ORDER columns present in the table
+        self.cols = [c for c in DESIRED_ORDER if c in self.schema]
+        # omitted from the INSERT when None, so the DB default applies
+        self.defaulted = frozenset(c for c in self.cols if self.colmeta[c]['default'] is not None)
+        # NOT NULL without a default: a value must be provided
+        self.required = frozenset(c for c in self.cols
+                                  if self.colmeta[c]['is_nullable'] == 'NO' and self.colmeta[c]['default'] is None)
+        # (statement name, PREPARE sql, columns) keyed by the bitmask of self.cols positions left
+        # out because their value is None and the DB has a default for them
+        self._stmts = {}
+
+    def statement(self, omit_mask):
+        stmt = self._stmts.get(omit_mask)
+        if stmt is None:
+            cols = [c for i, c in enumerate(self.cols) if not omit_mask & (1 << i)]
+            # name the statement by the plan generation and a bitmask over DESIRED_ORDER so it is
+            # stable across connections for this schema
+            name = 'reg_ins_%d_%d' % (self.generation, sum(1 << DESIRED_ORDER.index(c) for c in cols))
+            params = ','.join(f'${i}' for i in range(1, len(cols) + 1))
+            stmt = (name, f"PREPARE {name} AS INSERT INTO registration ({', '.join(cols)}) VALUES ({params})"
+                          " ON CONFLICT DO NOTHING RETURNING 1", cols)
+            self._stmts[omit_mask] = stmt
+        return stmt
+
+PLAN = InsertPlan()
+_PLAN_GENERATIONS = itertools.count(1)
+
+def load_schema():
+    global PLAN
+    rows = read_query("""
+        SELECT column_name, data_type, is_nullable, column_default
+        FROM information_schema.columns
+        WHERE table_name = 'registration'
+    """, fetchall=True)
+    PLAN = InsertPlan(rows, next(_PLAN_GENERATIONS))
+    log.info("Loaded registration schema (%d columns)", len(PLAN.schema))
+
+# returns False when a unique constraint (email/username etc.) already holds a matching row
+def execute_insert(conn, cur, plan, omit_mask, values):
+    name, prepare_sql, _ = plan.statement(omit_mask)
+    execute_sql = f"EXECUTE {name} ({','.join(['%s'] * len(values))})"
+    if name not in conn.prepared:
+        cur.execute(prepare_sql)
+        conn.prepared.add(name)
+    try:
+        cur.execute(execute_sql, tuple(values))
+    except psycopg2.errors.InvalidSqlStatementName:
+        # statement vanished server-side (e.g. DISCARD ALL from a pooler). Only reads can precede
+        # the insert in its transaction, so rolling back and re-preparing loses nothing.
+        log.warning("Prepared statement %s missing on connection, re-preparing", name)
+        conn.rollback()
+        cur.execute(prepare_sql)
+        cur.execute(execute_sql, tuple(values))
+    return cur.fetchone() is not None
+
+# imports at least this large go through COPY instead of batched INSERTs
+COPY_THRESHOLD = int(os.environ.get('COPY_THRESHOLD', 10000))
+
+# Resolve the bulk-import columns and row values, loading the schema first if the startup load
+# failed (as /submit does). Raises instead of returning an empty list, so a broken schema can't
+# pass for "every row was a duplicate". By default a column with a DB default is only included
+# when some row supplies a value for it; rows leaving it None still get the default.
+# password_hash values that aren't werkzeug hashes are hashed here (one scrypt per row), so
+# callers should pass hashes for large imports.
+# Returns (cols, {col: default SQL expression} for the included defaulted columns, value lists).
+def _bulk_rows(rows, cols=None):
+    if not PLAN.schema:
+        load_schema()
+    plan = PLAN
+    if cols is None:
+        cols = [c for c in plan.cols
+                if c not in plan.defaulted or any(r.get(c) is not None for r in rows)]
+    if not cols:
+        raise ValueError("No matching columns found in registration table")
+    defaults = {c: plan.colmeta[c]['default'] for c in cols if c in plan.defaulted}
+    values = []
+    for r in rows:
+        vals = [r.get(c) for c in cols]
+        if 'password_hash' in cols:
+            i = cols.index('password_hash')
+            if vals[i] and not _is_password_hash(vals[i]):
+                vals[i] = generate_password_hash(vals[i], method=PASSWORD_HASH_METHOD)
+        values.append(vals)
+    return cols, defaults, values
+
+# Batched insert for bulk ingestion (admin imports etc.). rows are dicts keyed by column name;
+# see _bulk_rows() for the default column list and password handling.
+# Rows clashing with an existing email/username are skipped. Returns the number inserted.
+def bulk_insert_registrations(rows, cols=None, page_size=500):
+    if not rows:
+        return 0
+    if len(rows) >= COPY_THRESHOLD:
+        return bulk_copy_registrations(rows, cols)
+    cols, defaults, values = _bulk_rows(rows, cols)
+    # None in a column with a DB default is sent as DEFAULT so e.g. the user_id sequence applies
+    default_idx = [i for i, c in enumerate(cols) if c in defaults]
+    for vals in values:
+        for i in default_idx:
+            if vals[i] is None:
+                vals[i] = AsIs('DEFAULT')
+    with get_cursor() as (conn, cur):
+        inserted = execute_values(
+            cur,
+            f"INSERT INTO registration ({', '.join(cols)}) VALUES %s ON CONFLICT DO NOTHING RETURNING 1",
+            [tuple(vals) for vals in values],
+            template=f"({','.join(['%s'] * len(cols))})",
+            page_size=page_size,
+            fetch=True
+        )
+        conn.commit()
+    log.info("Bulk inserted %d of %d registrations", len(inserted), len(rows))
+    return len(inserted)
+
+# COPY-based path for the largest imports. COPY cannot skip conflicts, so rows are copied into
+# a staging table first and moved over with INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+# The staging table is a session-private temp table (unlogged, matching the current column
+# types) dropped at commit, so concurrent imports don't collide and nothing is left behind.
+def bulk_copy_registrations(rows, cols=None):
+    if not rows:
+        return 0
+    cols, defaults, values = _bulk_rows(rows, cols)
+    # None is written as \N (COPY's NULL marker below) so it stays distinct from ''
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for vals in values:
+        writer.writerow(['\\N' if v is None else v for v in vals])
+    buf.seek(0)
+    col_list = ', '.join(cols)
+    # staged NULLs in defaulted columns take the column's DB default (defaults come from the catalog)
+    select_list = ', '.join(f"COALESCE({c}, {defaults[c]})" if c in defaults else c for c in cols)
+    with get_cursor() as (conn, cur):
+        cur.execute(f"""
+            CREATE TEMP TABLE registration_stage ON COMMIT DROP AS
+            SELECT {col_list} FROM registration WITH NO DATA
+        """)
+        cur.copy_expert(f"COPY registration_stage ({col_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+        cur.execute(f"""
+            INSERT INTO registration ({col_list})
+            SELECT {select_list} FROM registration_stage
+            ON CONFLICT DO NOTHING
+        """)
+        inserted = cur.rowcount
+        conn.commit()
+    log.info("Bulk copied %d of %d registrations", inserted, len(rows))
+    return inserted
+
+if POOL is not None:
+    try:
+        load_schema()
+    except Exception as e:
+        log.warning("Failed to load registration schema: %s", e)
+
+# Password hashing: scrypt, by default with werkzeug's own parameters so every worker and host
+# hashes at the same cost. Set PASSWORD_HASH_METHOD (e.g. "scrypt:65536:8:1") to pin other
+# parameters, or HASH_BUDGET_MS to benchmark the largest n that hashes within that budget. The
+# benchmark is opt-in: concurrent gunicorn workers measuring on shared cores see inflated times,
+# so run it once (e.g. with preload_app) and pin the result for the fleet.
+DEFAULT_PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+
+def _pick_scrypt_method(budget_ms, r=8, p=1):
+    method = f'scrypt:{2 ** 14}:{r}:{p}'
+    for log_n in range(14, 17):
+        candidate = f'scrypt:{2 ** log_n}:{r}:{p}'
+        start = time.perf_counter()
+        generate_password_hash('benchmark', method=candidate)
+        if (time.perf_counter() - start) * 1000 > budget_ms:
+            break
+        method = candidate
+    return method
+
+if os.environ.get('PASSWORD_HASH_METHOD'):
+    PASSWORD_HASH_METHOD = os.environ['PASSWORD_HASH_METHOD']
+elif os.environ.get('HASH_BUDGET_MS'):
+    PASSWORD_HASH_METHOD = _pick_scrypt_method(float(os.environ['HASH_BUDGET_MS']))
 else:
-    log.warning("Skipping registration_user_id_seq setup because DB connection is not available: %s", db_connect_error)
+    PASSWORD_HASH_METHOD = DEFAULT_PASSWORD_HASH_METHOD
+log.info("Using password hash method %s", PASSWORD_HASH_METHOD)
+
+# checked against when the login user does not exist, so unknown users take as long as wrong passwords
+DUMMY_PASSWORD_HASH = generate_password_hash('dummy-password', method=PASSWORD_HASH_METHOD)
+
+# werkzeug hashes look like "method$salt$hash"; anything else in password_hash is a legacy raw password
+def _is_password_hash(value):
+    return value.count('$') == 2 and value.startswith(('scrypt:', 'pbkdf2:'))
+
+# replace a legacy raw password with a hash after it has been verified
+def _upgrade_legacy_password(username, password):
+    new_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+    try:
+        with get_cursor() as (conn, cur):
+            cur.execute("UPDATE registration SET password_hash = %s WHERE username = %s AND password_hash = %s",
+                        (new_hash, username, password))
+            conn.commit()
+        log.info("Rehashed legacy password for %s", username)
+    except PoolTimeout:
+        raise
+    except Exception:
+        # the login itself succeeded; the upgrade is retried on the next login
+        log.exception("Failed to rehash legacy password for %s", username)
+
+# static markup (no template variables), so it is returned as-is rather than compiled per request
+LOGIN_HTML = (
+    '<h2>Login (fallback)</h2>'
+    '<form method="post">'
+    '<input name="username" placeholder="username or email">'
+    '<input name="password" type="password" placeholder="password">'
+    '<button type="submit">Login</button>'
+    '</form>'
+)
+
+LOGIN_FAILED_HTML = '<p>Invalid username or password.</p>' + LOGIN_HTML
+
+SUCCESS_HTML = (
+    '<h2>Thanks! Your info has been saved.</h2>'
+    '<p><a href="/home_loggedin">Go to Home (logged in)</a></p>'
+    '<p><a href="/">Go Back to Form</a></p>'
+    '<script>setTimeout(()=>{ window.location.href="/home_loggedin"; }, 2000);</script>'
+)
 
-from flask import request, redirect, url_for, render_template_string, session
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
-        # Note: this fallback does not verify credentials.
-        session['user'] = request.form.get('username')
-        return redirect(url_for('home_loggedin'))
-    return render_template_string(
-        '<h2>Login (fallback)</h2>'
-        '<form method="post">'
-        '<input name="username" placeholder="username">'
-        '<button type="submit">Login</button>'
-        '</form>'
-    )
+        if POOL is None:
+            log.error("DB not connected, cannot verify login: %s", db_connect_error)
+            return error_page('DB not connected:', 503, value=db_connect_error, back='/login')
+        identifier = request.form.get('username') or ''
+        password = request.form.get('password') or ''
+        row = None
+        if identifier:
+            # The login form accepts either the username or the email. One row's username can equal
+            # another row's email, so rank the match explicitly: an identifier containing '@' is
+            # taken as an email first, anything else as a username first.
+            if '@' in identifier:
+                rank = "LOWER(email) = LOWER(%s)"
+            else:
+                rank = "username = %s"
+            try:
+                row = read_query(
+                    "SELECT username, password_hash FROM registration"
+                    " WHERE username = %s OR LOWER(email) = LOWER(%s)"
+                    f" ORDER BY {rank} DESC LIMIT 1",
+                    (identifier, identifier, identifier)
+                )
+            except PoolTimeout:
+                raise
+            except Exception as e:
+                log.exception("Login lookup failed")
+                return error_page('DB error:', 503, value=e, back='/login')
+        # always run exactly one full hash check so response time does not reveal whether the user
+        # exists or still has a legacy (pre-hashing) password
+        stored = row[1] if row and row[1] else None
+        if stored and _is_password_hash(stored):
+            ok = check_password_hash(stored, password)
+        else:
+            check_password_hash(DUMMY_PASSWORD_HASH, password)
+            # rows saved before passwords were hashed hold the raw password
+            ok = stored is not None and hmac.compare_digest(stored.encode(), password.encode())
+            if ok:
+                _upgrade_legacy_password(row[0], password)
+        if ok:
+            session['user'] = row[0]
+            return redirect(url_for('home_loggedin'))
+        log.info("Failed login for %s", identifier)
+        return LOGIN_FAILED_HTML, 401
+    return LOGIN_HTML
 
 @app.route('/logout')
 def logout():
     session.pop('user', None)
     return redirect(url_for('index'))
 
+# Decide once at startup how the form is served instead of probing the template loader per request:
+# preferred: templates/student_form.html; fallback: "student form.html" in the project root.
+try:
+    app.jinja_env.get_template('student_form.html')
+    _INDEX = lambda: render_template('student_form.html')
+except TemplateNotFound:
+    _INDEX = lambda: send_from_directory(BASE_DIR, 'student form.html', max_age=STATIC_MAX_AGE, conditional=True)
+
 @app.route('/')
 def index():
     try:
-        # preferred: templates/student_form.html
-        return render_template('student_form.html')
-    except TemplateNotFound:
-        # fallback to the file you have in the project root named "student form.html"
-        return send_from_directory(os.path.dirname(__file__), 'student form.html')
+        return _INDEX()
     except Exception as e:
         log.exception("Error rendering form")
-        return f"<h2>Error rendering form:</h2><pre>{e}</pre>", 500
+        return error_page('Error rendering form:', 500, value=e)
+
+# form field names accepted for each registration column, in order of preference
+FORM_ALIASES = {
+    'full_name': ('full_name', 'name', 'fullname', 'fullName'),
+    'username': ('username', 'user'),
+    'password_hash': ('password_hash', 'password'),
+    'email': ('email',),
+    'phone': ('phone',),
+    'father_name': ('father_name', 'father'),
+    'mother_name': ('mother_name', 'mother'),
+    'address': ('address',),
+}
+
+# Returns the 409 page if the email (case-insensitive, matching the LOWER(email) index) or the
+# username is already registered, else None. Both checks go out as one statement, and only for
+# columns the table actually has. If the read check fails, log and proceed — the insert will be
+# caught and handled.
+def _duplicate_page(conn, cur, schema, email, username):
+    checks = []
+    if email and 'email' in schema:
+        checks.append(('email', "EXISTS(SELECT 1 FROM registration WHERE LOWER(email) = LOWER(%s))", email))
+    if username and 'username' in schema:
+        checks.append(('username', "EXISTS(SELECT 1 FROM registration WHERE username = %s)", username))
+    if not checks:
+        return None
+    try:
+        cur.execute("SELECT " + ", ".join(sql for _, sql, _ in checks), tuple(v for _, _, v in checks))
+        dups = {col for (col, _, _), hit in zip(checks, cur.fetchone()) if hit}
+    except Exception:
+        log.exception("Duplicate registration check failed")
+        try:
+            conn.rollback()
+        except Exception:
+            log.exception("Rollback failed after failed duplicate check")
+        return None
+    if not dups:
+        return None
+    try:
+        conn.rollback()
+    except Exception:
+        log.exception("Rollback failed after duplicate registration")
+    if 'email' in dups:
+        return error_page('Email already registered', 409,
+                          message=f"The email {email} is already in use.", login_link=True)
+    return error_page('Username already taken', 409,
+                      message=f"The username {username} is already in use. Choose another username.",
+                      login_link=True)
 
 @app.route('/submit', methods=['POST'])
 def submit():
     data = request.form
-    log.debug("Form Data Received: %s", dict(data))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Form Data Received: %s", dict(data))
 
-    if cur is None or conn is None:
+    if POOL is None:
         log.error("DB not connected, cannot save form: %s", db_connect_error)
-        return f"<h2>DB not connected:</h2><pre>{db_connect_error}</pre><a href='/'>Go Back</a>", 500
+        return error_page('DB not connected:', 500, value=db_connect_error)
 
-    # collect form values (support multiple common names)
-    full_name = data.get('full_name') or data.get('name') or data.get('fullname') or data.get('fullName')
+    # collect form values (support multiple common names): first non-empty alias wins
+    candidates = {col: next((data[a] for a in aliases if data.get(a)), data.get(aliases[-1]))
+                  for col, aliases in FORM_ALIASES.items()}
     raw_user_id = data.get('user_id')
-    username = data.get('username') or data.get('user')
-    password_hash = data.get('password_hash') or data.get('password')
-    email = data.get('email')
-    phone = data.get('phone')
-    father_name = data.get('father_name') or data.get('father')
-    mother_name = data.get('mother_name') or data.get('mother')
-    address = data.get('address')
-    age = None
-    try:
-        age = int(data.get('age')) if data.get('age') else None
-    except ValueError:
-        age = None
+    username = candidates['username']
+    email = candidates['email']
+    # at most 3 decimal digits: int() always parses that (longer digit strings can hit Python's
+    # int-conversion limit and raise ValueError), and no real age is longer
+    age_str = (data.get('age') or '').strip()
+    age = int(age_str) if age_str.isdecimal() and len(age_str) <= 3 else None
 
-    try:
-        # read table schema to decide which columns to insert
-        cur.execute("""
-            SELECT column_name, data_type
-            FROM information_schema.columns
-            WHERE table_name = 'registration'
-        """)
-        schema = {row[0]: row[1] for row in cur.fetchall()}
-
-        # prepare candidate values keyed by column name
-        candidates = {
-            'full_name': full_name,
-            'user_id': None,       # will fill below based on type
-            'username': username,
-            'password_hash': password_hash,
-            'email': email,
-            'phone': phone,
-            'father_name': father_name,
-            'mother_name': mother_name,
-            'address': address,
-            'age': age
-        }
-
-        # handle user_id depending on DB type
-        if 'user_id' in schema:
-            dt = schema['user_id'] or ''
-            # if integer type expected, try to parse raw_user_id; if not parseable, leave NULL so DB default can apply
-            if 'int' in dt:
-                try:
-                    candidates['user_id'] = int(raw_user_id) if raw_user_id is not None else None
-                except Exception:
-                    candidates['user_id'] = None
-            else:
-                candidates['user_id'] = raw_user_id or username
+    # never store the submitted password itself. Hashed before any connection is checked out so a
+    # pooled connection doesn't sit idle for the length of the hash.
+    if candidates['password_hash']:
+        candidates['password_hash'] = generate_password_hash(candidates['password_hash'],
+                                                             method=PASSWORD_HASH_METHOD)
 
-        # get nullability/default metadata
-        cur.execute("""
-            SELECT column_name, is_nullable, column_default
-            FROM information_schema.columns
-            WHERE table_name = 'registration'
-        """)
-        colmeta = {r[0]: {'is_nullable': r[1], 'default': r[2]} for r in cur.fetchall()}
-
-        # --- INSERT THIS BLOCK ---
-        # Robust uniqueness checks (case-insensitive for email) to avoid DB UniqueViolation.
+    # schema is cached at startup; retry the load if it failed then (e.g. table created later).
+    # Done before checking out the insert connection, since load_schema() needs one of its own.
+    if not PLAN.schema:
         try:
-            # check email case-insensitively (handles indexes that use lower(email))
-            if email:
-                cur.execute(
-                    "SELECT 1 FROM registration WHERE LOWER(email) = LOWER(%s) LIMIT 1",
-                    (email,)
-                )
-                if cur.fetchone():
-                    try:
-                        conn.rollback()
-                    except Exception:
-                        log.exception("Rollback failed after pre-insert duplicate email check")
-                    return (f"<h2>Email already registered</h2>"
-                            f"<p>The email {email} is already in use. If this is your account, please <a href='/login'>log in</a>."
-                            "<br><a href='/'>Go Back</a></p>"), 409
-
-            # check username (adjust column name if your DB uses a different column for username)
-            if username:
-                cur.execute("SELECT 1 FROM registration WHERE username = %s LIMIT 1", (username,))
-                if cur.fetchone():
-                    try:
-                        conn.rollback()
-                    except Exception:
-                        log.exception("Rollback failed after pre-insert duplicate username check")
-                    return (f"<h2>Username already taken</h2>"
-                            f"<p>The username {username} is already in use. Choose another username or <a href='/login'>log in</a>."
-                            "<br><a href='/'>Go Back</a></p>"), 409
-        except Exception:
-            # If the read check fails, log and proceed — the insert will be caught and handled.
-            log.exception("Pre-insert uniqueness check failed")
-        # --- END INSERT BLOCK ---
-
-        # build final insert columns/values from schema intersection
-        insert_cols = []
-        values = []
-        desired_order = ['full_name','user_id','username','password_hash','email','phone','father_name','mother_name','address','age']
-        for col in desired_order:
-            if col in schema:
-                val = candidates.get(col)
-                meta = colmeta.get(col)
-                # If value is None but column has a default, omit it so the DB default (e.g. sequence) is applied.
-                if val is None and meta and meta['default'] is not None:
-                    continue
-                insert_cols.append(col)
-                values.append(val)
-
-        if not insert_cols:
-            return "<h2>Error:</h2><pre>No matching columns found in registration table.</pre><a href='/'>Go Back</a>", 500
-
-        # Validate required (NOT NULL) columns that have no default: fail early with a clear message.
-        for i, col in enumerate(insert_cols):
-            meta = colmeta.get(col)
-            val = values[i]
-            if meta and meta['is_nullable'] == 'NO' and meta['default'] is None and val is None:
-                # Required DB column missing value — tell the user or change DB schema
-                return (f"<h2>Error:</h2><pre>Column '{col}' is required by the database but no value was provided."
-                        f" Provide a value in the form or alter the DB to use a default/sequence.</pre>"
-                        "<a href='/'>Go Back</a>"), 400
-
-        placeholders = ','.join(['%s'] * len(values))
-        sql = f"INSERT INTO registration ({', '.join(insert_cols)}) VALUES ({placeholders})"
-        cur.execute(sql, tuple(values))
-        conn.commit()
-        log.info("Inserted registration (cols=%s) for user=%s", insert_cols, username or raw_user_id)
-        return redirect('/success')
+            load_schema()
+        except PoolTimeout:
+            raise
+        except Exception as e:
+            log.exception("Error loading registration schema")
+            return error_page('Error saving data:', 500, value=e)
+    # one snapshot for the whole request, even if /admin/reload_schema swaps PLAN meanwhile
+    plan = PLAN
 
-    except psycopg2.errors.UniqueViolation as ue:
-        # specific friendly error for unique constraint (email/username etc.)
-        try:
-            conn.rollback()
-        except Exception:
-            log.exception("Rollback failed after UniqueViolation")
-        log.warning("Unique constraint violation: %s", ue)
-        return (f"<h2>Duplicate value</h2><p>A record with that email or unique field already exists."
-                f" If this is your account, please log in. Error: {ue}</p><a href='/'>Go Back</a>"), 400
+    # A connection lost before commit is retried once on a fresh one: the server rolled back the
+    # uncommitted INSERT, so nothing was written. A failure during commit itself is not retried.
+    for attempt in (1, 2):
+        committing = False
+        with get_cursor() as (conn, cur):
+            try:
+                schema = plan.schema
 
-    except psycopg2.IntegrityError as ie:
-        # other integrity errors (not-null, foreign key, etc.)
-        try:
-            conn.rollback()
-        except Exception:
-            log.exception("Rollback failed after IntegrityError")
-        log.exception("Integrity error saving data")
-        return f"<h2>Data integrity error</h2><pre>{ie}</pre><a href='/'>Go Back</a>", 400
+                # complete candidate values keyed by column name
+                candidates['user_id'] = None       # will fill below based on type
+                candidates['age'] = age
 
-    except Exception as e:
-        try:
-            conn.rollback()
-        except Exception:
-            log.exception("Rollback failed")
-        log.exception("Error saving data to DB")
-        return f"<h2>Error saving data:</h2><pre>{e}</pre><p>Received data: {dict(data)}</p><a href='/'>Go Back</a>"
+                # handle user_id depending on DB type
+                if 'user_id' in schema:
+                    dt = schema['user_id'] or ''
+                    # if integer type expected, try to parse raw_user_id; if not parseable, leave NULL so DB default can apply
+                    if 'int' in dt:
+                        try:
+                            candidates['user_id'] = int(raw_user_id) if raw_user_id is not None else None
+                        except Exception:
+                            candidates['user_id'] = None
+                    else:
+                        candidates['user_id'] = raw_user_id or username
+
+                # gather values in the precomputed plan.cols order. A None value for a column with a
+                # default is left out (bit set in omit_mask) so the DB default (e.g. sequence) is applied.
+                omit_mask = 0
+                values = []
+                for i, col in enumerate(plan.cols):
+                    val = candidates[col]
+                    if val is None:
+                        if col in plan.defaulted:
+                            omit_mask |= 1 << i
+                            continue
+                        if col in plan.required:
+                            # Required DB column missing value — tell the user or change DB schema
+                            return error_page('Error:', 400,
+                                              value=f"Column '{col}' is required by the database but no value was provided."
+                                                    " Provide a value in the form or alter the DB to use a default/sequence.")
+                    values.append(val)
+
+                if not values:
+                    return error_page('Error:', 500, value='No matching columns found in registration table.')
+
+                if not UNIQUE_INDEXES and (email or username):
+                    dup = _duplicate_page(conn, cur, schema, email, username)
+                    if dup is not None:
+                        return dup
+
+                if not execute_insert(conn, cur, plan, omit_mask, values):
+                    # ON CONFLICT skipped the row; one more query tells the user which field clashed
+                    return _duplicate_page(conn, cur, schema, email, username) or error_page(
+                        'Duplicate value', 409,
+                        message='A record with that email or unique field already exists.', login_link=True)
+                committing = True
+                conn.commit()
+                if log.isEnabledFor(logging.INFO):
+                    log.info("Inserted registration (cols=%s) for user=%s", plan.statement(omit_mask)[2], username or raw_user_id)
+                return redirect('/success')
+
+            except psycopg2.errors.UniqueViolation as ue:
+                # specific friendly error for unique constraint (email/username etc.)
+                try:
+                    conn.rollback()
+                except Exception:
+                    log.exception("Rollback failed after UniqueViolation")
+                log.warning("Unique constraint violation: %s", ue)
+                return error_page('Duplicate value', 400,
+                                  message='A record with that email or unique field already exists.',
+                                  value=ue, login_link=True)
+
+            except psycopg2.IntegrityError as ie:
+                # other integrity errors (not-null, foreign key, etc.)
+                try:
+                    conn.rollback()
+                except Exception:
+                    log.exception("Rollback failed after IntegrityError")
+                log.exception("Integrity error saving data")
+                return error_page('Data integrity error', 400, value=ie)
+
+            except Exception as e:
+                if (isinstance(e, psycopg2.OperationalError) and conn.closed
+                        and not committing and attempt == 1):
+                    log.warning("DB connection lost before commit (%s), retrying on a fresh connection", e)
+                    continue
+                try:
+                    conn.rollback()
+                except Exception:
+                    log.exception("Rollback failed")
+                log.exception("Error saving data to DB")
+                return error_page('Error saving data:', 500, message=f"Received data: {dict(data)}", value=e)
 
 @app.route('/success')
 def success():
-    return (
-        '<h2>Thanks! Your info has been saved.</h2>'
-        '<p><a href="/home_loggedin">Go to Home (logged in)</a></p>'
-        '<p><a href="/">Go Back to Form</a></p>'
-        '<script>setTimeout(()=>{ window.location.href="/home_loggedin"; }, 2000);</script>'
-    )
+    return SUCCESS_HTML
 
 @app.route('/home_loggedin')
 def home_loggedin():
     # serve the static home_loggedin.html from the project folder
-    return send_from_directory(os.path.dirname(__file__), 'home_loggedin.html')
+    return send_from_directory(BASE_DIR, 'home_loggedin.html', max_age=STATIC_MAX_AGE, conditional=True)
+
+# Last /db_status probe result. Health checkers can poll as often as they like; Postgres sees
+# at most one SELECT 1 per DB_STATUS_TTL seconds.
+DB_STATUS_TTL = float(os.environ.get('DB_STATUS_TTL', 5))
+_HEALTH = {'t': None, 'body': None, 'status': None}
 
 @app.route('/db_status')
 def db_status():
-    if cur is None:
+    if POOL is None:
+        return f'DB connection error: {db_connect_error}', 500
+    now = time.monotonic()
+    if _HEALTH['t'] is not None and now - _HEALTH['t'] < DB_STATUS_TTL:
+        return _HEALTH['body'], _HEALTH['status']
+    try:
+        read_query('SELECT 1')
+        body, status = 'DB OK', 200
+    except Exception as e:
+        body, status = f'DB error: {e}', 500
+    _HEALTH.update(t=now, body=body, status=status)
+    return body, status
+
+# /admin/reload_schema requires this token in the X-Admin-Token header; unset disables the route
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+@app.route('/admin/reload_schema', methods=['POST'])
+def reload_schema():
+    token = request.headers.get('X-Admin-Token') or ''
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return 'Forbidden', 403
+    if POOL is None:
         return f'DB connection error: {db_connect_error}', 500
     try:
-        cur.execute('SELECT 1')
-        _ = cur.fetchone()
-        return 'DB OK', 200
+        load_schema()
+        return f'Schema reloaded ({len(PLAN.schema)} columns)', 200
     except Exception as e:
-        return f'DB error: {e}', 500
+        log.exception("Schema reload failed")
+        return f'Schema reload failed: {e}', 500
 
 if __name__ == '__main__':
+    if sys.argv[1:] == ['migrate']:
+        migrate()
+        sys.exit(0)
+    migrate()
     try:
         log.info("Calling app.run(host=127.0.0.1, port=5000)")
-        # bind to localhost explicitly; keep debug on for development
-        app.run(debug=True, host='127.0.0.1', port=5000, use_reloader=False)
+        # development server only; in production run `gunicorn -c gunicorn.conf.py wsgi:app`.
+        # bind to localhost explicitly; set FLASK_DEBUG=1 for the debugger
+        app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='127.0.0.1', port=5000,
+                use_reloader=False, threaded=True)
     except Exception as e:
         log.exception("Unhandled exception running Flask")
         raise
\ No newline at end of file
@@ -0,0 +1,19 @@
+# WSGI entry point for production. Deploy with:
+#   python server.py migrate          # once per deploy: sequence + unique index setup
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# Workers never run DDL at import. `python server.py` still starts the Werkzeug development
+# server (and migrates first).
+
+# Patch before anything imports psycopg2: gevent makes the stdlib cooperative and psycogreen
+# makes libpq calls yield to the event loop, so one greenlet waiting on Postgres does not
+# stall the whole worker. Requires the gevent and psycogreen packages.
+from gevent import monkey
+monkey.patch_all()
+
+import psycogreen.gevent
+psycogreen.gevent.patch_psycopg()
+
+from server import app
+
+if __name__ == '__main__':
+    app.run()